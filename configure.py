@@ -1,22 +1,168 @@
 import argparse
+import functools
+import importlib.util
 import io
 import os
 import sys
 import shutil
 import platform
-import requests
-import zipfile
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from ninja import ninja_syntax
 from pathlib import Path
-from typing import Optional, List
+from typing import BinaryIO, Dict, Iterable, Optional, List, Tuple
 
 
 MUSL_CROSS_MAKE_COMMIT = "fe915821b652a7fa37b34a596f47d8e20bc72338"
+PATCHES_DIR = f"patches/musl-cross-make-{MUSL_CROSS_MAKE_COMMIT}/patches"
+SCRIPT_DIR = Path(__file__).parent.absolute()
+
+# shared by argparse and the CONFIGURE_FASTPATH parser
+_DEFAULTS = {
+    "no_patches": False,
+    "fail_fast": False,
+    "prefix": "$root_dir/toolchain",
+    "legacy_downloader": False,
+    "jobs": None,
+    "load": None,
+    "host": None,
+    "target": None,
+    "cc": "$host-gcc",
+    "cxx": "$host-g++",
+    "cc_build": "gcc",
+    "cxx_build": "g++",
+    "cc_flags": None,
+    "cxx_flags": None,
+    "ld_flags": None,
+    "enable_cache": False,
+    "binutils_flags": None,
+    "gcc_flags": None,
+    "gcc_with_isl": False,
+    "binutils_version": "2.33.1",  # https://ftp.gnu.org/gnu/binutils
+    "gcc_version": "9.4.0",  # https://ftp.gnu.org/gnu/gcc
+    "gmp_version": "6.1.2",  # https://ftp.gnu.org/gnu/gmp
+    "mpc_version": "1.1.0",  # https://ftp.gnu.org/gnu/mpc
+    "mpfr_version": "4.0.2",  # https://ftp.gnu.org/gnu/mpfr
+    "isl_version": "0.24",  # https://libisl.sourceforge.io
+    # "isl_version": "0.26",
+    "linux_version": "6.1.34",  # https://www.kernel.org
+    "musl_version": "1.2.3",  # https://musl.libc.org
+}
+def _non_negative_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a non-negative integer")
+
+    return number
+
+
+def _non_negative_float(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        number = -1.0
+
+    # also rejects nan and inf, make -l has no use for them
+    if not 0 <= number < float("inf"):
+        raise argparse.ArgumentTypeError(f"{value!r} is not a non-negative number")
+
+    return number
+
+
+# everything else takes a string
+_OPTION_TYPES = {
+    "no_patches": bool,
+    "fail_fast": bool,
+    "legacy_downloader": bool,
+    "enable_cache": bool,
+    "gcc_with_isl": bool,
+    "jobs": _non_negative_int,
+    "load": _non_negative_float,
+}
+
+# https://git.musl-libc.org/cgit/musl/tree/INSTALL
+# https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux.git/tree/arch
+_ARCH_PREFIX_MAP = (
+    ("aarch64", "arm64"),
+    ("arm", "arm"),
+    ("microblaze", "microblaze"),
+    ("mips", "mips"),
+    ("or1k", "openrisc"),
+    ("powerpc", "powerpc"),
+    ("riscv", "riscv"),
+    ("s390", "s390"),
+    ("sh", "sh"),
+    ("x86_64", "x86_64"),
+)
+_X86_ARCH_RE = re.compile(r"^i[3-6]86$")
+
+_TARGET_GCC_FLAGS = (
+    (lambda t: "fdpic" in t, "--enable-fdpic"),
+    (lambda t: t.startswith("x86_64") and t.endswith("x32"), "--with-abi=x32"),
+    (lambda t: "powerpc64" in t, "--with-abi=elfv2"),
+    (lambda t: _is_mips64(t) and "n32" in t, "--with-abi=n32"),
+    (lambda t: _is_mips64(t) and "n32" not in t, "--with-abi=64"),
+    (lambda t: "s390x" in t, "--with-long-double-128"),
+    (lambda t: t.endswith("sf"), "--with-float=soft"),
+    (lambda t: t.endswith("hf"), "--with-float=hard"),
+)
+
+
+def _target(name: str) -> str:
+    return f"$build_targets_dir/{name}"
+
+
+_INSTALL_NAMES = ("binutils", "gcc", "musl", "linux")
+# ninja_syntax only takes lists, never mutate these
+_INSTALL_TARGETS = [f"$install_{name}" for name in _INSTALL_NAMES]
+_DEFAULT_TARGETS = [_target("build-gcc"), _target("build-linux")]
+
+
+@functools.lru_cache(maxsize=None)
+def _which(cmd: str) -> Optional[str]:
+    return shutil.which(cmd)
+
+
+def _is_mips64(target: str) -> bool:
+    return "mips64" in target or "mipsisa64" in target
+
+
+def _cpu_count() -> int:
+    # respect cpusets (containers, taskset) where they are available, copied
+    # into remover.py
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+@dataclass(frozen=True)
+class Component:
+    name: str
+    version: str
+    url: str
+    links_into_gcc: bool = False
+
+    @property
+    def compression(self) -> str:
+        return self.url.rsplit(".", 1)[-1]
+
+    @property
+    def tarball(self) -> str:
+        return f"$download_dir/{self.name}-${self.name}_version.tar.{self.compression}"
 
 
 class Args:
     no_patches = (bool,)
+    fail_fast = (bool,)
     prefix = (str,)
+    jobs = (int,)
+    load = (float,)
 
     host = (Optional[str],)
     target = (str,)
@@ -29,6 +175,8 @@ class Args:
     cxx_flags = (str,)
     ld_flags = (str,)
     enable_cache = (bool,)
+    compiler_wrapper = (str,)
+    legacy_downloader = (bool,)
 
     binutils_flags = (List[str],)
     gcc_flags = (List[str],)
@@ -43,12 +191,30 @@ class Args:
     mpfr_version = (str,)
     musl_version = (str,)
 
+    components = (Tuple[Component, ...],)
+
     _make = (str,)
 
     def __init__(self, args: argparse.Namespace) -> None:
         self.no_patches = args.no_patches
+        self.fail_fast = args.fail_fast
         self.prefix = args.prefix
 
+        cpu_count = _cpu_count()
+        # empty or 0 counts as unset
+        env_jobs = os.environ.get("MUSL_TOOLCHAINS_JOBS", "").strip()
+
+        if env_jobs:
+            if not env_jobs.isdecimal():
+                print(
+                    f"Error: MUSL_TOOLCHAINS_JOBS must be a non-negative integer, got {env_jobs!r}"
+                )
+                sys.exit(1)
+
+            cpu_count = int(env_jobs) or cpu_count
+        self.jobs = args.jobs or cpu_count
+        self.load = args.load or cpu_count
+
         self.host = args.host
         self.target = args.target
 
@@ -60,6 +226,8 @@ class Args:
         self.cxx_flags = args.cxx_flags
         self.ld_flags = args.ld_flags
         self.enable_cache = args.enable_cache
+        self.compiler_wrapper = ""
+        self.legacy_downloader = args.legacy_downloader
 
         # configure options
         self.binutils_flags = [
@@ -102,28 +270,9 @@ class Args:
         if self.host:
             self.gcc_flags.append("--host=$host")
 
-        if "fdpic" in self.target:
-            self.gcc_flags.append("--enable-fdpic")
-
-        if self.target.startswith("x86_64") and self.target.endswith("x32"):
-            self.gcc_flags.append("--with-abi=x32")
-
-        if "powerpc64" in self.target:
-            self.gcc_flags.append("--with-abi=elfv2")
-
-        if "mips64" in self.target or "mipsisa64" in self.target:
-            if "n32" in self.target:
-                self.gcc_flags.append("--with-abi=n32")
-            else:
-                self.gcc_flags.append("--with-abi=64")
-
-        if "s390x" in self.target:
-            self.gcc_flags.append("--with-long-double-128")
-
-        if self.target.endswith("sf"):
-            self.gcc_flags.append("--with-float=soft")
-        elif self.target.endswith("hf"):
-            self.gcc_flags.append("--with-float=hard")
+        self.gcc_flags.extend(
+            flag for (matches, flag) in _TARGET_GCC_FLAGS if matches(self.target)
+        )
 
         if args.gcc_flags:
             self.gcc_flags.extend(args.gcc_flags.split(" "))
@@ -139,6 +288,61 @@ class Args:
         self.mpfr_version = args.mpfr_version
         self.musl_version = args.musl_version
 
+        components = [
+            Component(
+                "binutils",
+                self.binutils_version,
+                "$gnu_site/binutils/binutils-$binutils_version.tar.xz",
+            ),
+            Component(
+                "gcc",
+                self.gcc_version,
+                "$gnu_site/gcc/gcc-$gcc_version/gcc-$gcc_version.tar.xz",
+            ),
+            Component(
+                "gmp",
+                self.gmp_version,
+                "$gnu_site/gmp/gmp-$gmp_version.tar.xz",
+                links_into_gcc=True,
+            ),
+        ]
+
+        if self.gcc_with_isl:
+            components.append(
+                Component(
+                    "isl",
+                    self.isl_version,
+                    "$isl_site/isl-$isl_version.tar.xz",
+                    links_into_gcc=True,
+                )
+            )
+
+        components.extend([
+            Component(
+                "linux",
+                self.linux_version,
+                "$linux_site/linux-$linux_version.tar.xz",
+            ),
+            Component(
+                "mpc",
+                self.mpc_version,
+                "$gnu_site/mpc/mpc-$mpc_version.tar.gz",
+                links_into_gcc=True,
+            ),
+            Component(
+                "mpfr",
+                self.mpfr_version,
+                "$gnu_site/mpfr/mpfr-$mpfr_version.tar.xz",
+                links_into_gcc=True,
+            ),
+            Component(
+                "musl",
+                self.musl_version,
+                "$musl_site/releases/musl-$musl_version.tar.gz",
+            ),
+        ])
+        self.components = tuple(components)
+
         self._make = "make"
 
     def is_cross(self) -> bool:
@@ -146,21 +350,22 @@ class Args:
 
     def dependencies_summary(self) -> None:
         print("\nDependencies:")
-        print(f"  binutils {self.binutils_version}")
-        print(f"       gcc {self.gcc_version}")
-        print(f"       gmp {self.gmp_version}")
 
-        if self.gcc_with_isl:
-            print(f"       isl {self.isl_version}")
+        for component in self.components:
+            print(f"{component.name:>10} {component.version}")
 
-        print(f"     linux {self.linux_version}")
-        print(f"       mpc {self.mpc_version}")
-        print(f"      mpfr {self.mpfr_version}")
-        print(f"      musl {self.musl_version}\n")
+        print()
+
+    @staticmethod
+    def _which_all(cmds: List[str]) -> None:
+        # shutil.which is mostly stat calls, so looking every tool up at
+        # once hides the PATH walks behind each other and fills the cache
+        with ThreadPoolExecutor(max_workers=len(cmds)) as executor:
+            list(executor.map(_which, cmds))
 
     @staticmethod
     def _exists(cmd: str, msg: str) -> bool:
-        path = shutil.which(cmd)
+        path = _which(cmd)
         if path is not None:
             print(f"{msg}: {cmd} ({path})")
             return True
@@ -171,42 +376,67 @@ class Args:
     def try_get_tools(self):
         failed = False
 
+        if self.host:
+            self.cc = self.cc.replace("$host", self.host).lstrip("-")
+            self.cxx = self.cxx.replace("$host", self.host).lstrip("-")
+
+        # with --fail-fast tools are looked up one at a time instead, so
+        # nothing past the first missing one is probed
+        if not self.fail_fast:
+            tools = [self.cc_build, self.cxx_build]
+
+            if self.host:
+                tools.extend([self.cc, self.cxx])
+
+            if self.enable_cache:
+                tools.extend(["sccache", "ccache"])
+
+            tools.extend(["make", "gmake", "mingw32-make"])
+
+            if self.legacy_downloader:
+                tools.append("curl")
+
+            tools.extend(["patch", "tar", "xz"])
+            self._which_all(tools)
+
         if not self._exists(self.cc_build, "Checking for build C compiler"):
             failed = True
+        if self.fail_fast and failed:
+            return True
         if not self._exists(self.cxx_build, "Checking for build C++ compiler"):
             failed = True
+        if self.fail_fast and failed:
+            return True
 
         if self.host:
-            self.cc = self.cc.replace("$host", self.host).lstrip("-")
-            self.cxx = self.cxx.replace("$host", self.host).lstrip("-")
-
             if not self._exists(self.cc, "Checking for host C compiler"):
                 failed = True
+            if self.fail_fast and failed:
+                return True
             if not self._exists(self.cxx, "Checking for host C++ compiler"):
                 failed = True
+            if self.fail_fast and failed:
+                return True
         else:
             self.cc = self.cc_build
             self.cxx = self.cxx_build
 
         if self.enable_cache:
-            ccache = self._exists("ccache", "Checking for tool ccache")
-            sccache = None
+            sccache = self._exists("sccache", "Checking for tool sccache")
+            ccache = None
             wrapper = None
 
-            if ccache:
-                wrapper = "ccache"
+            if sccache:
+                wrapper = "sccache"
             else:
-                sccache = self._exists("sccache", "Checking for tool sccache")
+                ccache = self._exists("ccache", "Checking for tool ccache")
 
-                if sccache:
-                    wrapper = "sccache"
+                if ccache:
+                    wrapper = "ccache"
 
             if wrapper:
                 print(f"Using {wrapper} as compiler wrapper")
-                self.cc = f"{wrapper} {self.cc}"
-                self.cxx = f"{wrapper} {self.cxx}"
-                self.cc_build = f"{wrapper} {self.cc_build}"
-                self.cxx_build = f"{wrapper} {self.cxx_build}"
+                self.compiler_wrapper = wrapper
 
         if self._exists("make", "Checking for tool make"):
             self._make = "make"
@@ -217,223 +447,228 @@ class Args:
         else:
             failed = True
 
-        if not self._exists("curl", "Checking for tool curl"):
-            failed = True
+        if self.fail_fast and failed:
+            return True
+
+        if self.legacy_downloader:
+            if not self._exists("curl", "Checking for tool curl"):
+                failed = True
+        else:
+            # downloader.py talks http2, which httpx only does with h2
+            for module in ("httpx", "h2"):
+                if importlib.util.find_spec(module) is None:
+                    print(f"Checking for python module {module} (doesn't exists)")
+                    failed = True
+
+        if self.fail_fast and failed:
+            return True
 
         if not self._exists("patch", "Checking for tool patch"):
             failed = True
 
+        if self.fail_fast and failed:
+            return True
+
         if not self._exists("tar", "Checking for tool tar"):
             failed = True
 
+        if self.fail_fast and failed:
+            return True
+
+        if not self._exists("xz", "Checking for tool xz"):
+            failed = True
+
         return failed
 
     def ninja(self) -> None:
-        cpu_count = os.cpu_count()
-        print("Writing build.ninja")
-        with open("build.ninja", "w") as f:
-            writer = ninja_syntax.Writer(f)
+        with io.StringIO() as buf:
+            writer = ninja_syntax.Writer(buf)
+
+            def emit_vars(pairs: Iterable[Tuple[str, object]]) -> None:
+                # one write per group of variables, followed by a blank line
+                buf.write(
+                    "".join(
+                        f"{key} = {value}\n"
+                        for (key, value) in pairs
+                        if value is not None
+                    )
+                    + "\n"
+                )
+
             writer.variable("target", self.target)
             writer.variable("host", self.host)
             writer.newline()
-            writer.variable("cc", self.cc)
-            writer.variable("cxx", self.cxx)
+            compiler_vars = [("cc", self.cc), ("cxx", self.cxx)]
 
             if not self.is_cross():
-                writer.variable("cc_build", self.cc_build)
-                writer.variable("cxx_build", self.cxx_build)
+                compiler_vars.extend(
+                    [("cc_build", self.cc_build), ("cxx_build", self.cxx_build)]
+                )
 
-            writer.variable("cc_flags", self.cc_flags)
-            writer.variable("cxx_flags", self.cxx_flags)
-            writer.variable("ld_flags", self.ld_flags)
-            writer.newline()
-            writer.variable("binutils_version", self.binutils_version)
-            writer.variable("gcc_version", self.gcc_version)
-            writer.variable("gmp_version", self.gmp_version)
+            if self.compiler_wrapper:
+                compiler_vars.append(("compiler_wrapper", self.compiler_wrapper))
+
+            compiler_vars.extend([
+                ("cc_flags", self.cc_flags),
+                ("cxx_flags", self.cxx_flags),
+                ("ld_flags", self.ld_flags),
+            ])
+            emit_vars(compiler_vars)
+            emit_vars(
+                (f"{component.name}_version", component.version)
+                for component in self.components
+            )
+            site_vars = [("gnu_site", "https://ftpmirror.gnu.org")]
 
             if self.gcc_with_isl:
-                writer.variable("isl_version", self.isl_version)
+                site_vars.append(("isl_site", "https://libisl.sourceforge.io"))
 
-            writer.variable("linux_version", self.linux_version)
-            writer.variable("mpc_version", self.mpc_version)
-            writer.variable("mpfr_version", self.mpfr_version)
-            writer.variable("musl_version", self.musl_version)
-            writer.newline()
-            writer.variable("gnu_site", "https://ftpmirror.gnu.org")
+            site_vars.extend([
+                ("linux_site", "https://cdn.kernel.org/pub/linux/kernel/v6.x"),
+                ("musl_site", "https://www.musl-libc.org"),
+            ])
+            emit_vars(site_vars)
+            writer.variable("python", sys.executable)
 
-            if self.gcc_with_isl:
-                writer.variable("isl_site", "https://libisl.sourceforge.io")
+            if self.legacy_downloader:
+                writer.variable("download_command", "curl -L --fail --retry 3 -o")
+            else:
+                writer.variable("downloader", SCRIPT_DIR / "downloader.py")
+
+            writer.variable("remover", SCRIPT_DIR / "remover.py")
 
-            writer.variable(
-                "linux_site", "https://cdn.kernel.org/pub/linux/kernel/v6.x"
-            )
-            writer.variable("musl_site", "https://www.musl-libc.org")
-            writer.newline()
-            writer.variable("download_command", f"curl -L -o")
             writer.variable(
                 "make_command",
-                f"{self._make} -j {cpu_count} MULTILIB_OSDIRNAMES= INFO_DEPS= infodir= ac_cv_prog_lex_root=lex.yy MAKEINFO=false",
+                f"{self._make} -j {self.jobs} -l {self.load} MULTILIB_OSDIRNAMES= INFO_DEPS= infodir= ac_cv_prog_lex_root=lex.yy MAKEINFO=false",
             )
             writer.newline()
             writer.comment("edit below this line carefully")
             writer.newline()
-            env_vars = 'CC="$cc" CXX="$cxx" CFLAGS="$cc_flags" CXXFLAGS="$cxx_flags" LDFLAGS="$ld_flags"'
+            launcher = "$compiler_wrapper " if self.compiler_wrapper else ""
+            env_vars = f'CC="{launcher}$cc" CXX="{launcher}$cxx" CFLAGS="$cc_flags" CXXFLAGS="$cxx_flags" LDFLAGS="$ld_flags"'
 
             if not self.is_cross():
-                env_vars += ' CC_FOR_BUILD="$cc_build" CXX_FOR_BUILD="$cxx_build"'
+                env_vars += f' CC_FOR_BUILD="{launcher}$cc_build" CXX_FOR_BUILD="{launcher}$cxx_build"'
 
             writer.variable("env_vars", env_vars)
             writer.newline()
-            writer.variable("root_dir", Path(".").absolute())
-            writer.variable("build_dir", "build")
-            writer.variable("build_sysroot_dir",
-                            "$root_dir/$build_dir/sysroot")
-            writer.variable("build_targets_dir", "$build_dir/targets")
-            writer.variable("download_dir", "downloads")
-            writer.variable("install_dir", self.prefix)
+            emit_vars([
+                ("root_dir", os.getcwd()),
+                ("build_dir", "build"),
+                ("build_sysroot_dir", "$root_dir/$build_dir/sysroot"),
+                ("build_targets_dir", "$build_dir/targets"),
+                ("download_dir", "downloads"),
+                ("install_dir", self.prefix),
+            ])
+            # the install stamps are named by several edges
+            emit_vars(
+                (f"install_{name}", _target(f"install-{name}"))
+                for name in _INSTALL_NAMES
+            )
+            gcc_env_vars = "$env_vars"
+
+            if self.compiler_wrapper == "ccache":
+                # gcc is built with absolute -B and sysroot paths, let ccache
+                # rewrite them so hits survive a different checkout directory
+                writer.variable(
+                    "ccache_basedir_env", "CCACHE_BASEDIR=$root_dir CCACHE_NOHASHDIR=1"
+                )
+                writer.newline()
+                gcc_env_vars = "$ccache_basedir_env $env_vars"
+
+            writer.pool("download", 4)
+            writer.pool("configure", self.jobs)
             writer.newline()
             writer.comment("step 1 - download, extract and patch archives")
             writer.newline()
 
-            download_targets = ["binutils", "gcc", "gmp"]
-
-            if self.gcc_with_isl:
-                download_targets.append("isl")
+            for component in self.components:
+                writer.variable(f"{component.name}_tarball", component.tarball)
 
-            download_targets.extend(["linux", "mpc", "mpfr", "musl"])
-
-            for name in download_targets:
-                compression = "xz"
-
-                if name in ["mpc", "musl"]:
-                    compression = "gz"
+            writer.newline()
 
+            for component in self.components:
                 writer.variable(
-                    f"{name}_tarball",
-                    f"$download_dir/{name}-${name}_version.tar.{compression}",
+                    f"{component.name}_dir",
+                    f"$build_dir/{component.name}-${component.name}_version",
                 )
 
             writer.newline()
+            tarball_urls = [
+                (f"${component.name}_tarball", component.url)
+                for component in self.components
+            ]
 
-            for name in download_targets:
-                writer.variable(
-                    f"{name}_dir", f"$build_dir/{name}-${name}_version")
-
-            writer.newline()
-            writer.rule(
-                "download-tarball",
-                "$download_command $out $url",
-                description="Downloading $url",
-            )
-            writer.newline()
-            writer.rule(
-                "extract-tar",
-                "rm -rf $extracted_dir && tar -C $build_dir -x -$compression -f $in && cd $extracted_dir && $patch_command && touch ../../$out",
-                description="Extracting $in",
-            )
-            writer.newline()
-            writer.build(
-                "$binutils_tarball",
-                "download-tarball",
-                pool="console",
-                variables={
-                    "url": "$gnu_site/binutils/binutils-$binutils_version.tar.xz"
-                },
-            )
-            writer.newline()
-            writer.build(
-                "$gcc_tarball",
-                "download-tarball",
-                pool="console",
-                variables={
-                    "url": "$gnu_site/gcc/gcc-$gcc_version/gcc-$gcc_version.tar.xz"
-                },
-            )
-            writer.newline()
-            writer.build(
-                "$gmp_tarball",
-                "download-tarball",
-                pool="console",
-                variables={"url": "$gnu_site/gmp/gmp-$gmp_version.tar.xz"},
-            )
+            if self.legacy_downloader:
+                writer.rule(
+                    "download-tarball",
+                    "$download_command $out $url",
+                    description="Downloading $url",
+                )
 
-            if self.gcc_with_isl:
+                for (tarball, url) in tarball_urls:
+                    writer.newline()
+                    writer.build(
+                        tarball,
+                        "download-tarball",
+                        pool="download",
+                        variables={"url": url},
+                    )
+            else:
+                # one process fetches everything, reusing connections
+                writer.rule(
+                    "download-tarballs",
+                    "$python $downloader --jobs 4 $downloads",
+                    description="Downloading tarballs",
+                )
                 writer.newline()
                 writer.build(
-                    "$isl_tarball",
-                    "download-tarball",
-                    pool="console",
-                    variables={"url": "$isl_site/isl-$isl_version.tar.xz"},
+                    [tarball for (tarball, _) in tarball_urls],
+                    "download-tarballs",
+                    variables={
+                        "downloads": " ".join(
+                            f"--download {tarball} {url}"
+                            for (tarball, url) in tarball_urls
+                        )
+                    },
                 )
 
             writer.newline()
-            writer.build(
-                "$linux_tarball",
-                "download-tarball",
-                pool="console",
-                variables={"url": "$linux_site/linux-$linux_version.tar.xz"},
-            )
-            writer.newline()
-            writer.build(
-                "$mpc_tarball",
-                "download-tarball",
-                pool="console",
-                variables={"url": "$gnu_site/mpc/mpc-$mpc_version.tar.gz"},
-            )
-            writer.newline()
-            writer.build(
-                "$mpfr_tarball",
-                "download-tarball",
-                pool="console",
-                variables={"url": "$gnu_site/mpfr/mpfr-$mpfr_version.tar.xz"},
-            )
-            writer.newline()
-            writer.build(
-                "$musl_tarball",
-                "download-tarball",
-                pool="console",
-                variables={
-                    "url": "$musl_site/releases/musl-$musl_version.tar.gz"},
+            # tar runs xz single threaded, so hand it xz -T0 instead. tar checks
+            # the decompressor's exit status, a plain xz | tar pipe would not
+            writer.rule(
+                "extract-tar",
+                'rm -rf $extracted_dir && if [ "$compression" = "J" ]; then tar -C $build_dir --use-compress-program="xz -T0" -xf $in; else tar -C $build_dir -xzf $in; fi && cd $extracted_dir && $patch_command && touch ../../$out',
+                description="Extracting $in",
             )
             writer.newline()
+            patch_index = {}
 
-            name_version_tuples = [
-                ("binutils", self.binutils_version),
-                ("gcc", self.gcc_version),
-                ("gmp", self.gmp_version),
-            ]
-
-            if self.gcc_with_isl:
-                name_version_tuples.append(("isl", self.isl_version))
-
-            name_version_tuples.extend([
-                ("linux", self.linux_version),
-                ("mpc", self.mpc_version),
-                ("mpfr", self.mpfr_version),
-                ("musl", self.musl_version),
-            ])
+            if not self.no_patches:
+                patch_index = _index_patches(
+                    f"{component.name}-{component.version}"
+                    for component in self.components
+                )
 
-            for (name, version) in name_version_tuples:
-                compression = "J"
+            for component in self.components:
+                name = component.name
+                version = component.version
+                compression = "J" if component.compression == "xz" else "z"
                 patch_command = "true"
 
-                if name in ["mpc", "musl"]:
-                    compression = "x"
-
                 if not self.no_patches:
-                    patch = Patch(name, version)
+                    patch = Patch(name, version, patch_index)
 
                     if patch.exists():
-                        patch_command = "patch -p 1"
+                        parts = ["patch -p 1"]
+                        parts.extend(f"-i ../../{p}" for p in patch.files())
 
-                        for patch_file in patch.files():
-                            patch_command += f" -i ../../{patch_file}"
-
-                        if patch_command == "patch -p 1":
-                            patch_command = "true"
+                        # an empty patch directory leaves nothing to apply
+                        if len(parts) > 1:
+                            patch_command = " ".join(parts)
 
                 writer.build(
-                    f"$build_targets_dir/extract-{name}",
+                    _target(f"extract-{name}"),
                     f"extract-tar",
                     inputs=[f"${name}_tarball"],
                     variables={
@@ -467,23 +702,23 @@ class Args:
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/configure-binutils",
+                _target("configure-binutils"),
                 "configure-binutils",
-                implicit=["$build_targets_dir/extract-binutils"],
-                pool="console",
+                implicit=[_target("extract-binutils")],
+                pool="configure",
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/build-binutils",
+                _target("build-binutils"),
                 "build-binutils",
-                implicit=["$build_targets_dir/configure-binutils"],
+                implicit=[_target("configure-binutils")],
                 pool="console",
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/install-binutils",
+                "$install_binutils",
                 "install-binutils",
-                implicit=["$build_targets_dir/build-binutils"],
+                implicit=[_target("build-binutils")],
                 pool="console",
             )
             writer.newline()
@@ -496,38 +731,42 @@ class Args:
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/build-sysroot-dir-dep",
+                _target("build-sysroot-dir-dep"),
                 "build-sysroot-dir-dep",
             )
             writer.newline()
             writer.comment("step 4 - configure gcc")
             writer.newline()
+            # link instead of moving so the extracted trees stay in place and
+            # a re-configure does not force them to be extracted again
             writer.rule(
-                "move-directory",
-                f"rm -rf $dst_dir && mv $src_dir $dst_dir && touch $out",
-                description="Moving $src_dir -> $dst_dir",
+                "link-directory",
+                f"rm -rf $dst_dir && ln -sfn $root_dir/$src_dir $dst_dir && touch $out",
+                description="Linking $src_dir -> $dst_dir",
             )
 
-            move_targets = ["gmp"]
-
-            if self.gcc_with_isl:
-                move_targets.append("isl")
-
-            move_targets.extend(["mpc", "mpfr"])
-            build_targets_move = []
+            link_targets = [
+                component.name
+                for component in self.components
+                if component.links_into_gcc
+            ]
+            build_targets_link = []
 
-            for name in move_targets:
+            for name in link_targets:
                 writer.newline()
                 writer.build(
-                    f"$build_targets_dir/move-{name}",
-                    "move-directory",
-                    implicit=[f"$build_targets_dir/extract-{name}"],
+                    _target(f"link-{name}"),
+                    "link-directory",
+                    implicit=[
+                        _target(f"extract-{name}"),
+                        _target("extract-gcc"),
+                    ],
                     variables={
                         "src_dir": f"${name}_dir",
                         "dst_dir": f"$gcc_dir/{name}",
                     },
                 )
-                build_targets_move.append(f"$build_targets_dir/move-{name}")
+                build_targets_link.append(_target(f"link-{name}"))
 
             writer.newline()
             writer.variable("gcc_dir", "$build_dir/gcc-build")
@@ -552,37 +791,52 @@ class Args:
 
             writer.rule(
                 "configure-gcc",
-                f'rm -rf $gcc_dir && mkdir $gcc_dir && cd $gcc_dir && $env_vars ../gcc-$gcc_version/configure {" ".join(self.gcc_flags)} {" ".join(gcc_vars)} && touch ../../$out',
+                f'rm -rf $gcc_dir && mkdir $gcc_dir && cd $gcc_dir && {gcc_env_vars} ../gcc-$gcc_version/configure {" ".join(self.gcc_flags)} {" ".join(gcc_vars)} && touch ../../$out',
                 description="Configuring gcc $gcc_version",
             )
             writer.newline()
 
-            implicit = ["$build_targets_dir/extract-gcc"]
-            implicit.extend(build_targets_move)
+            implicit = [_target("extract-gcc")]
+            implicit.extend(build_targets_link)
             implicit.extend([
-                "$build_targets_dir/build-binutils",
-                "$build_targets_dir/build-sysroot-dir-dep",
+                _target("build-binutils"),
+                _target("build-sysroot-dir-dep"),
             ])
             writer.build(
-                "$build_targets_dir/configure-gcc",
+                _target("configure-gcc"),
                 "configure-gcc",
                 implicit=implicit,
-                pool="console",
+                pool="configure",
             )
             writer.newline()
             writer.comment("step 5 - build gcc (all-gcc)")
             writer.newline()
+            # every make invocation in $gcc_dir goes through these rules, the
+            # restat variant is for edges whose output is a real file make
+            # leaves untouched when there is nothing to do
+            gcc_make = f"cd $gcc_dir && {gcc_env_vars} $make_command $make_args"
             writer.rule(
-                "build-gcc-all-gcc",
-                'cd $gcc_dir && $env_vars $make_command MAKE="$make_command" all-gcc && touch ../../$out',
-                description="Building gcc $gcc_version (all-gcc)",
+                "gcc-make",
+                f"{gcc_make} && touch ../../$out",
+                description="$message",
+            )
+            writer.newline()
+            writer.rule(
+                "gcc-make-restat",
+                gcc_make,
+                description="$message",
+                restat=True,
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/build-gcc-all-gcc",
-                "build-gcc-all-gcc",
-                implicit=["$build_targets_dir/configure-gcc"],
+                _target("build-gcc-all-gcc"),
+                "gcc-make",
+                implicit=[_target("configure-gcc")],
                 pool="console",
+                variables={
+                    "make_args": 'MAKE="$make_command" all-gcc',
+                    "message": "Building gcc $gcc_version (all-gcc)",
+                },
             )
             writer.newline()
             writer.comment("step 6 - configure musl")
@@ -601,7 +855,7 @@ class Args:
             if self.is_cross():
                 host_exe_suffix = ".exe" if platform.system() == "Windows" else ""
                 musl_configure_env_vars.append(
-                    f'CC="$root_dir/$gcc_dir/gcc/xgcc{host_exe_suffix} -B $root_dir/$gcc_dir/gcc"'
+                    f'CC="{launcher}$root_dir/$gcc_dir/gcc/xgcc{host_exe_suffix} -B $root_dir/$gcc_dir/gcc"'
                 )
                 musl_vars.extend(
                     [
@@ -612,7 +866,7 @@ class Args:
             else:
                 musl_configure_env_vars.extend(
                     [
-                        "CC=${target}-gcc",
+                        f'CC="{launcher}${{target}}-gcc"',
                         "CROSS_COMPILE=${target}-",
                     ]
                 )
@@ -623,7 +877,6 @@ class Args:
                     ]
                 )
 
-            # use cache
             writer.newline()
             writer.rule(
                 "configure-musl",
@@ -632,143 +885,127 @@ class Args:
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/configure-musl",
+                _target("configure-musl"),
                 "configure-musl",
                 implicit=[
-                    "$build_targets_dir/extract-musl",
-                    "$build_targets_dir/build-gcc-all-gcc",
+                    _target("extract-musl"),
+                    _target("build-gcc-all-gcc"),
                 ],
-                pool="console",
+                pool="configure",
             )
             writer.newline()
             writer.comment("step 7 - install musl (headers)")
             writer.newline()
+            # every make invocation in $musl_dir goes through these rules
+            musl_make = "cd $musl_dir && $env_vars $make_command $make_args"
             writer.rule(
-                "install-musl-headers-dep",
-                f"cd $musl_dir && $env_vars $make_command DESTDIR=$build_sysroot_dir prefix=/usr install-headers && touch ../../$out",
-                description="Configuring musl $musl_version",
+                "musl-make",
+                f"{musl_make} && touch ../../$out",
+                description="$message",
+            )
+            writer.newline()
+            writer.rule(
+                "musl-make-restat",
+                musl_make,
+                description="$message",
+                restat=True,
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/install-musl-headers-dep",
-                "install-musl-headers-dep",
-                implicit=["$build_targets_dir/configure-musl"],
+                _target("install-musl-headers-dep"),
+                "musl-make",
+                implicit=[_target("configure-musl")],
                 pool="console",
+                variables={
+                    "make_args": "DESTDIR=$build_sysroot_dir prefix=/usr install-headers",
+                    "message": "Installing musl $musl_version headers at $build_sysroot_dir",
+                },
             )
             writer.newline()
             writer.comment("step 8 - build gcc (all-target-libgcc)")
             writer.newline()
-            writer.rule(
-                "build-gcc-all-target-libgcc",
-                'cd $gcc_dir && $env_vars $make_command MAKE="$make_command enable_shared=no" all-target-libgcc && touch ../../$out',
-                description="Building gcc $gcc_version (all-target-libgcc)",
-            )
-            writer.newline()
             writer.build(
-                "$build_targets_dir/build-gcc-all-target-libgcc",
-                "build-gcc-all-target-libgcc",
-                implicit=["$build_targets_dir/install-musl-headers-dep"],
+                "$gcc_dir/$target/libgcc/libgcc.a",
+                "gcc-make-restat",
+                implicit=[_target("install-musl-headers-dep")],
                 pool="console",
+                variables={
+                    "make_args": 'MAKE="$make_command enable_shared=no" all-target-libgcc',
+                    "message": "Building gcc $gcc_version (all-target-libgcc)",
+                },
             )
             writer.newline()
             writer.comment("step 9 - build musl")
             writer.newline()
-            writer.rule(
-                "build-musl",
-                f'cd $musl_dir && $env_vars $make_command {" ".join(musl_vars)} && touch ../../$out',
-                description="Building musl $musl_version",
-            )
-            writer.newline()
-            writer.rule(
-                "install-musl-dep",
-                "cd $musl_dir && $env_vars $make_command DESTDIR=$build_sysroot_dir prefix=/usr install && touch ../../$out",
-                description="Installing musl $musl_version at $build_sysroot_dir",
-            )
-            writer.newline()
-            writer.rule(
-                "install-musl",
-                "cd $musl_dir && $env_vars $make_command DESTDIR=$install_dir/$target install && touch ../../$out",
-                description="Installing musl $musl_version",
-            )
-            writer.newline()
             writer.build(
-                "$build_targets_dir/build-musl",
-                "build-musl",
-                implicit=["$build_targets_dir/build-gcc-all-target-libgcc"],
+                "$musl_dir/lib/libc.a",
+                "musl-make-restat",
+                implicit=["$gcc_dir/$target/libgcc/libgcc.a"],
                 pool="console",
+                variables={
+                    "make_args": " ".join(musl_vars),
+                    "message": "Building musl $musl_version",
+                },
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/install-musl-dep",
-                "install-musl-dep",
-                implicit=["$build_targets_dir/build-musl"],
+                _target("install-musl-dep"),
+                "musl-make",
+                implicit=["$musl_dir/lib/libc.a"],
                 pool="console",
+                variables={
+                    "make_args": "DESTDIR=$build_sysroot_dir prefix=/usr install",
+                    "message": "Installing musl $musl_version at $build_sysroot_dir",
+                },
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/install-musl",
-                "install-musl",
-                implicit=["$build_targets_dir/build-musl"],
+                "$install_musl",
+                "musl-make",
+                implicit=["$musl_dir/lib/libc.a"],
                 pool="console",
+                variables={
+                    "make_args": "DESTDIR=$install_dir/$target install",
+                    "message": "Installing musl $musl_version",
+                },
             )
             writer.newline()
             writer.comment("step 10 - build gcc")
             writer.newline()
-            writer.rule(
-                "build-gcc",
-                'cd $gcc_dir && $env_vars $make_command MAKE="$make_command" && touch ../../$out',
-                description="Building gcc $gcc_version",
-            )
-            writer.newline()
-            writer.rule(
-                "install-gcc",
-                'cd $gcc_dir && $env_vars $make_command MAKE="$make_command" DESTDIR=$install_dir install && touch ../../$out',
-                description="Installing gcc $gcc_version",
-            )
-            writer.newline()
             writer.build(
-                "$build_targets_dir/build-gcc",
-                "build-gcc",
-                implicit=["$build_targets_dir/install-musl-dep"],
+                _target("build-gcc"),
+                "gcc-make",
+                implicit=[_target("install-musl-dep")],
                 pool="console",
+                variables={
+                    "make_args": 'MAKE="$make_command"',
+                    "message": "Building gcc $gcc_version",
+                },
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/install-gcc",
-                "install-gcc",
-                implicit=["$build_targets_dir/build-gcc"],
+                "$install_gcc",
+                "gcc-make",
+                implicit=[_target("build-gcc")],
                 pool="console",
+                variables={
+                    "make_args": 'MAKE="$make_command" DESTDIR=$install_dir install',
+                    "message": "Installing gcc $gcc_version",
+                },
             )
             writer.newline()
             writer.comment("step 11 - install linux (headers)")
             writer.newline()
-            
-            # https://git.musl-libc.org/cgit/musl/tree/INSTALL
-            # https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux.git/tree/arch
-            arch = self.target.split("-")[0]
-            
-            if arch.startswith("aarch64"):
-            	arch = "arm64"
-            elif arch.startswith("arm"):
-                arch = "arm"
-            elif arch.startswith("i") and arch.endswith("86"):
-            	arch = "x86"
-            elif arch.startswith("microblaze"):
-                arch = "microblaze"
-            elif arch.startswith("mips"):
-                arch = "mips"
-            elif arch.startswith("or1k"):
-                arch = "openrisc"
-            elif arch.startswith("powerpc"):
-                arch = "powerpc"
-            elif arch.startswith("riscv"):
-                arch = "riscv"
-            elif arch.startswith("s390"):
-                arch = "s390"
-            elif arch.startswith("sh"):
-                arch = "sh"
-            elif arch.startswith("x86_64"):
-                arch = "x86_64"
+
+            raw_arch = self.target.split("-")[0]
+
+            if _X86_ARCH_RE.match(raw_arch):
+                arch = "x86"
+            else:
+                arch = next(
+                    (v for p, v in _ARCH_PREFIX_MAP if raw_arch.startswith(p)),
+                    raw_arch,
+                )
 
             writer.variable("arch", arch)
             writer.newline()
@@ -785,86 +1022,263 @@ class Args:
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/build-linux",
+                _target("build-linux"),
                 "build-linux",
-                implicit=["$build_targets_dir/extract-linux"],
+                implicit=[_target("extract-linux")],
                 pool="console",
             )
             writer.newline()
             writer.build(
-                "$build_targets_dir/install-linux",
+                "$install_linux",
                 "install-linux",
-                implicit=["$build_targets_dir/build-linux"],
+                implicit=[_target("build-linux")],
                 pool="console",
             )
             writer.newline()
             writer.comment("clean targets")
             writer.newline()
-            writer.rule("delete-directory", "rm -rf $in",
-                        description="Deleting $in")
-            writer.newline()
-            writer.rule("clean-all", "true", description="Cleaned everything")
+            writer.rule(
+                "delete-directory",
+                f"$python $remover --jobs {self.jobs} $path",
+                description="Deleting $path",
+            )
             writer.newline()
             writer.build(
                 "clean-build",
                 "delete-directory",
-                inputs=["$build_dir"],
+                variables={"path": "$build_dir"},
             )
             writer.build(
                 "clean-downloads",
                 "delete-directory",
-                inputs=["$download_dir"],
+                variables={"path": "$download_dir"},
             )
             writer.build(
                 "clean",
-                "clean-all",
-                implicit=["clean-build", "clean-downloads"],
+                "phony",
+                inputs=["clean-build", "clean-downloads"],
             )
             writer.newline()
             writer.comment("install targets")
             writer.newline()
-            writer.rule(
-                "install-all", "true", description="Installed toolchain at $install_dir"
-            )
-            writer.newline()
             writer.build(
                 "install",
-                "install-all",
-                implicit=[
-                    "$build_targets_dir/install-binutils",
-                    "$build_targets_dir/install-gcc",
-                    "$build_targets_dir/install-musl",
-                    "$build_targets_dir/install-linux",
-                ],
+                "phony",
+                inputs=_INSTALL_TARGETS,
             )
             writer.newline()
             writer.comment("default targets")
             writer.newline()
-            writer.default(
-                [
-                    "$build_targets_dir/build-gcc",
-                    "$build_targets_dir/build-linux",
-                ]
-            )
+            writer.default(_DEFAULT_TARGETS)
+
+            content = buf.getvalue().encode("utf-8")
+
+        # leave an identical build.ninja alone so its mtime does not make
+        # ninja reload the manifest for nothing
+        try:
+            if Path("build.ninja").read_bytes() == content:
+                print("build.ninja is up to date")
+                return
+        except FileNotFoundError:
+            pass
+
+        print("Writing build.ninja")
+        # write everything at once so an interrupted run never leaves a
+        # half written build.ninja behind
+        Path("build.ninja.tmp").write_bytes(content)
+        os.replace("build.ninja.tmp", "build.ninja")
+
+
+def _index_patches(wanted: Iterable[str]) -> Dict[str, List[str]]:
+    # one scandir of the patches dir tells which of the wanted name-version
+    # dirs exist, only those are listed
+    wanted = set(wanted)
+    index = {}
+
+    try:
+        with os.scandir(PATCHES_DIR) as dirs:
+            for entry in dirs:
+                if entry.name in wanted and entry.is_dir():
+                    with os.scandir(entry.path) as files:
+                        # patches are numbered and must be applied in order
+                        index[entry.name] = sorted(f.name for f in files)
+    except FileNotFoundError:
+        pass
+
+    return index
 
 
 class Patch:
-    name = str,
-    version = str,
+    __slots__ = ("name", "version", "path", "_files")
 
-    path = str,
+    name: str
+    version: str
 
-    def __init__(self, name: str, version: str):
+    path: str
+    _files: Optional[Tuple[str, ...]]
+
+    def __init__(self, name: str, version: str, index: Dict[str, List[str]]):
         self.name = name
         self.version = version
 
-        self.path = f"patches/musl-cross-make-{MUSL_CROSS_MAKE_COMMIT}/patches/{name}-{version}"
+        self.path = f"{PATCHES_DIR}/{name}-{version}"
+        entries = index.get(f"{name}-{version}")
+        # built once, files() hands out the same tuple every time
+        self._files = (
+            None if entries is None else tuple(f"{self.path}/{i}" for i in entries)
+        )
 
     def exists(self) -> bool:
-        return Path(self.path).exists()
+        return self._files is not None
+
+    def files(self) -> Tuple[str, ...]:
+        return self._files
 
-    def files(self) -> List[str]:
-        return [f"{self.path}/{i}" for i in os.listdir(self.path)]
+
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _check_tar_member(member: "tarfile.TarInfo", dest: str) -> None:
+    import tarfile
+
+    # what tarfile.data_filter rejects, for pythons without it (< 3.10.12)
+    root = os.path.realpath(dest)
+
+    def inside(path: str) -> bool:
+        return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+    if os.path.isabs(member.name) or not inside(os.path.join(dest, member.name)):
+        raise tarfile.TarError(f"{member.name} is outside of {dest}")
+
+    if member.issym():
+        target = os.path.join(dest, os.path.dirname(member.name), member.linkname)
+    elif member.islnk():
+        target = os.path.join(dest, member.linkname)
+    elif member.isfile() or member.isdir():
+        return
+    else:
+        raise tarfile.TarError(f"{member.name} is a special file")
+
+    if os.path.isabs(member.linkname) or not inside(target):
+        raise tarfile.TarError(f"{member.name} links outside of {dest}")
+
+
+def _extract_tar(tf: "tarfile.TarFile", dest: str) -> None:
+    import tarfile
+
+    has_data_filter = hasattr(tarfile, "data_filter")
+    # filter is only a keyword of extract() where data_filter exists
+    extract_args = {"filter": "data"} if has_data_filter else {}
+
+    # a gzip stream can only be decompressed in order, but writing out the
+    # many small patch files can overlap with it
+    with ThreadPoolExecutor(max_workers=_cpu_count()) as executor:
+        futures = []
+
+        for member in tf:
+            # reject absolute paths, links pointing outside dest, etc.
+            if has_data_filter:
+                member = tarfile.data_filter(member, dest)
+            else:
+                _check_tar_member(member, dest)
+
+            path = os.path.join(dest, member.name)
+
+            if member.isfile() and member.size <= 1 << 20:
+                data = tf.extractfile(member).read()
+                futures.append(executor.submit(_write_file, path, data))
+            elif member.isfile():
+                # copy anything big straight from the stream instead of
+                # holding all of it in memory for the pool
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                with tf.extractfile(member) as src, open(path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 16)
+            elif member.isdir():
+                os.makedirs(path, exist_ok=True)
+            else:
+                tf.extract(member, dest, set_attrs=False, **extract_args)
+
+        for future in futures:
+            future.result()
+
+
+class _TeeReader:
+    def __init__(self, src: BinaryIO, dst: BinaryIO) -> None:
+        self.src = src
+        self.dst = dst
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.src.read(size)
+        self.dst.write(data)
+        return data
+
+
+def _download_patches(extracted_dir: str, sentinel: Path) -> None:
+    # only needed on the first run, so keep them off the import path
+    import tarfile
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+
+    url = f"https://codeload.github.com/richfelker/musl-cross-make/tar.gz/{MUSL_CROSS_MAKE_COMMIT}"
+    cache_dir = Path("patches/.cache")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    archive = cache_dir / f"{MUSL_CROSS_MAKE_COMMIT}.tar.gz"
+    etag_file = cache_dir / f"{MUSL_CROSS_MAKE_COMMIT}.etag"
+    lastmod_file = cache_dir / f"{MUSL_CROSS_MAKE_COMMIT}.lastmod"
+    headers = {"User-Agent": "musl-toolchains-configure"}
+
+    # revalidate a previously downloaded archive instead of fetching it again
+    # after the extracted dir was removed
+    if archive.exists():
+        if etag_file.exists():
+            headers["If-None-Match"] = etag_file.read_text()
+        if lastmod_file.exists():
+            headers["If-Modified-Since"] = lastmod_file.read_text()
+
+    # left behind by an interrupted run
+    shutil.rmtree(extracted_dir, ignore_errors=True)
+
+    print(f"Downloading patches from {url}")
+
+    try:
+        response = urlopen(Request(url, headers=headers))
+    except HTTPError as e:
+        if e.code != 304:
+            raise
+
+        print(f"Patches are not modified, extracting {archive}")
+
+        with tarfile.open(archive, mode="r:gz") as tf:
+            _extract_tar(tf, "patches")
+    else:
+        part = cache_dir / f"{MUSL_CROSS_MAKE_COMMIT}.tar.gz.part"
+        print(f"Extracting patches at {extracted_dir}")
+
+        # extract while downloading, keeping a copy for later runs
+        with response, open(part, "wb") as f:
+            with tarfile.open(fileobj=_TeeReader(response, f), mode="r|gz") as tf:
+                _extract_tar(tf, "patches")
+
+            # tarfile stops at the end-of-archive marker, keep the trailing
+            # bytes so the cached copy is complete
+            shutil.copyfileobj(response, f)
+
+        os.replace(part, archive)
+
+        for (file, header) in [(etag_file, "ETag"), (lastmod_file, "Last-Modified")]:
+            value = response.headers.get(header)
+
+            if value:
+                file.write_text(value)
+            elif file.exists():
+                file.unlink()
+
+    sentinel.touch()
 
 
 def main(args: argparse.Namespace) -> None:
@@ -872,16 +1286,11 @@ def main(args: argparse.Namespace) -> None:
 
     if not args.no_patches:
         extracted_dir = f"patches/musl-cross-make-{MUSL_CROSS_MAKE_COMMIT}"
+        # only written once the extraction completed
+        sentinel = Path(f"patches/.ok-{MUSL_CROSS_MAKE_COMMIT}")
 
-        if not Path(extracted_dir).exists():
-            url = f"https://github.com/richfelker/musl-cross-make/archive/{MUSL_CROSS_MAKE_COMMIT}.zip"
-            print(f"Downloading patches from {url}")
-            response = requests.get(url)
-            data = io.BytesIO(response.content)
-            print(f"Extracting patches at {extracted_dir}")
-            f = zipfile.ZipFile(data)
-            f.extractall("patches")
-            f.close()
+        if not sentinel.exists():
+            _download_patches(extracted_dir, sentinel)
         else:
             print(f"Patches are already downloaded at {extracted_dir}")
 
@@ -895,23 +1304,51 @@ def main(args: argparse.Namespace) -> None:
     args.ninja()
 
 
-if __name__ == "__main__":
+class _HelpFormatter(argparse.ArgumentDefaultsHelpFormatter):
+    # "(default: None)" says nothing, options computing their default
+    # describe it in their help instead
+    def _get_help_string(self, action: argparse.Action) -> Optional[str]:
+        if action.default is None:
+            return action.help
+
+        return super()._get_help_string(action)
+
+
+def _parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog="setup",
         description="Configure musl cross toolchain.",
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        formatter_class=_HelpFormatter,
     )
     parser.add_argument(
         "--no-patches",
         action="store_true",
-        default=False,
         help="Do not apply patches from richfelker/musl-cross-make.",
     )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop checking for tools at the first one that is missing.",
+    )
     parser.add_argument(
         "--prefix",
-        default="$root_dir/toolchain",
         help="Directory where to install toolchain.",
     )
+    parser.add_argument(
+        "--legacy-downloader",
+        action="store_true",
+        help="Download tarballs with one curl process each instead of downloader.py.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=_non_negative_int,
+        help="Number of parallel make jobs. Defaults to the number of usable CPUs.",
+    )
+    parser.add_argument(
+        "--load",
+        type=_non_negative_float,
+        help="Do not start new make jobs above this load average. Defaults to the number of usable CPUs.",
+    )
     group = parser.add_argument_group("toolchain options")
     group.add_argument(
         "--host",
@@ -925,102 +1362,146 @@ if __name__ == "__main__":
     group = parser.add_argument_group("compiler options")
     group.add_argument(
         "--cc",
-        default=f"$host-gcc",
         help="C compiler for host.",
     )
     group.add_argument(
         "--cxx",
-        default=f"$host-g++",
         help="C++ compiler for host.",
     )
     group.add_argument(
         "--cc-build",
-        default=f"gcc",
         help="C compiler for build.",
     )
     group.add_argument(
         "--cxx-build",
-        default=f"g++",
         help="C++ compiler for build.",
     )
     group.add_argument(
         "--cc-flags",
-        default=None,
         help="Extra C compiler flags.",
     )
     group.add_argument(
         "--cxx-flags",
-        default=None,
         help="Extra C++ compiler flags.",
     )
     group.add_argument(
         "--ld-flags",
-        default=None,
         help="Extra linker flags.",
     )
     group.add_argument(
         "--enable-cache",
         action="store_true",
-        default=False,
-        help="Use ccache or sccache (if available) as compiler wrapper.",
+        help="Use sccache or ccache (if available) as compiler wrapper.",
     )
     group = parser.add_argument_group("configure options")
     group.add_argument(
         "--binutils-flags",
-        default=None,
         help="Add extra flags when configuring binutils.",
     )
     group.add_argument(
         "--gcc-flags",
-        default=None,
         help="Add extra flags when configuring gcc.",
     )
     group.add_argument(
         "--gcc-with-isl",
         action="store_true",
-        default=False,
         help="Build gcc with isl support.",
     )
     group = parser.add_argument_group("dependencies")
     group.add_argument(
         "--binutils-version",
-        default="2.33.1",  # https://ftp.gnu.org/gnu/binutils
         help="Binutils version to build.",
     )
     group.add_argument(
         "--gcc-version",
-        default="9.4.0",  # https://ftp.gnu.org/gnu/gcc
         help="Gcc version to build.",
     )
     group.add_argument(
         "--gmp-version",
-        default="6.1.2",  # https://ftp.gnu.org/gnu/gmp
         help="Gmp version to build.",
     )
     group.add_argument(
         "--mpc-version",
-        default="1.1.0",  # https://ftp.gnu.org/gnu/mpc
         help="Mpc version to build.",
     )
     group.add_argument(
         "--mpfr-version",
-        default="4.0.2",  # https://ftp.gnu.org/gnu/mpfr
         help="Mpfr version to build.",
     )
     group.add_argument(
         "--isl-version",
-        default="0.24",  # https://libisl.sourceforge.io
-        # default="0.26",
         help="Isl version to build.",
     )
     group.add_argument(
         "--linux-version",
-        default="6.1.34",  # https://www.kernel.org
         help="Linux version to build.",
     )
     group.add_argument(
         "--musl-version",
-        default="1.2.3",  # https://musl.libc.org
         help="Musl version to build.",
     )
-    main(parser.parse_args())
+    parser.set_defaults(**_DEFAULTS)
+    return parser
+
+
+def _fast_parse_args(argv: List[str]) -> Optional[argparse.Namespace]:
+    # a plain loop over the flags, returns None to leave --help, abbreviated
+    # flags and every error to argparse
+    values = dict(_DEFAULTS)
+    i = 0
+
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+
+        if not arg.startswith("--"):
+            return None
+
+        (name, sep, value) = arg[2:].partition("=")
+        dest = name.replace("-", "_")
+
+        if dest not in values:
+            return None
+
+        kind = _OPTION_TYPES.get(dest, str)
+
+        if kind is bool:
+            if sep:
+                return None
+
+            values[dest] = True
+            continue
+
+        if not sep:
+            if i == len(argv):
+                return None
+
+            value = argv[i]
+            i += 1
+
+            # argparse refuses option-like values (--prefix --no-patches),
+            # let it report that
+            if value.startswith("-"):
+                return None
+
+        try:
+            values[dest] = kind(value)
+        except (ValueError, argparse.ArgumentTypeError):
+            return None
+
+    if values["target"] is None:
+        return None
+
+    return argparse.Namespace(**values)
+
+
+if __name__ == "__main__":
+    args = None
+
+    if os.environ.get("CONFIGURE_FASTPATH"):
+        args = _fast_parse_args(sys.argv[1:])
+
+    if args is None:
+        args = _parser().parse_args()
+
+    main(args)
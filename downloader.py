@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import os
+import httpx
+from typing import List, Tuple
+
+
+async def download(
+    client: httpx.AsyncClient, semaphore: asyncio.Semaphore, out: str, url: str
+) -> None:
+    # the edge covers every tarball, so only fetch the ones that are missing
+    if os.path.exists(out):
+        return
+
+    async with semaphore:
+        print(f"Downloading {url}")
+        part = f"{out}.part"
+
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+
+            with open(part, "wb") as f:
+                async for chunk in response.aiter_bytes(1 << 16):
+                    f.write(chunk)
+
+        # never leave a truncated tarball behind under the real name
+        os.replace(part, out)
+
+
+async def download_all(downloads: List[Tuple[str, str]], jobs: int) -> None:
+    semaphore = asyncio.Semaphore(jobs)
+    limits = httpx.Limits(max_keepalive_connections=8)
+    # retry failed connects, mirrors drop them now and then
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=3)
+
+    async with httpx.AsyncClient(
+        transport=transport, follow_redirects=True, timeout=60
+    ) as client:
+        await asyncio.gather(
+            *(download(client, semaphore, out, url) for (out, url) in downloads)
+        )
+
+
+def main(args: argparse.Namespace) -> None:
+    for (out, _) in args.download:
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+
+    asyncio.run(download_all(args.download, args.jobs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="downloader",
+        description="Download source tarballs over shared HTTP/2 connections.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Maximum number of concurrent downloads.",
+    )
+    parser.add_argument(
+        "--download",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("OUT", "URL"),
+        help="Download URL to OUT. Can be given multiple times.",
+    )
+    main(parser.parse_args())
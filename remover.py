@@ -0,0 +1,80 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+# remover.py runs on its own from build.ninja and does not import
+# configure.py, so this is a copy of configure.py's _cpu_count(). Keep the
+# two in sync. configure.py passes --jobs explicitly, so this only sets the
+# default when running the script by hand.
+def _cpu_count() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def _unlink_all(paths: List[str]) -> None:
+    for path in paths:
+        os.unlink(path)
+
+
+def remove(path: str, jobs: int) -> None:
+    if not os.path.lexists(path):
+        return
+
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.unlink(path)
+        return
+
+    dirs = []
+
+    # unlinking is where the time goes, so spread it over threads one
+    # directory at a time and remove the emptied directories afterwards
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+
+        # bottom up, so dirs ends up children first
+        for (dirpath, dirnames, filenames) in os.walk(path, topdown=False):
+            # os.walk does not descend into symlinked dirs, they are unlinked
+            # like files
+            files = [os.path.join(dirpath, name) for name in filenames]
+
+            for name in dirnames:
+                child = os.path.join(dirpath, name)
+
+                if os.path.islink(child):
+                    files.append(child)
+
+            if files:
+                futures.append(executor.submit(_unlink_all, files))
+
+            dirs.append(dirpath)
+
+        for future in futures:
+            future.result()
+
+    for dirpath in dirs:
+        os.rmdir(dirpath)
+
+
+def main(args: argparse.Namespace) -> None:
+    for path in args.paths:
+        remove(path, args.jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="remover",
+        description="Remove directory trees, unlinking files in parallel.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=_cpu_count(),
+        help="Number of threads unlinking files.",
+    )
+    parser.add_argument("paths", nargs="+", help="Paths to remove.")
+    main(parser.parse_args())